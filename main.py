@@ -1,420 +1,995 @@
-# main.py — Perfect5Bot: Market Hours Filter Added (Full Exchanges)
-import os, base64, json, logging, threading, time
-from datetime import datetime, timedelta, timezone
-from flask import Flask, jsonify
-import pandas as pd
-import requests
-from tvDatafeed import TvDatafeed, Interval
-from ta.trend import EMAIndicator
-from ta.volatility import AverageTrueRange
-import pickle
-
-# -----------------------------
-# Logging
-# -----------------------------
-logging.basicConfig(level=logging.INFO, format="%(asctime)s | %(levelname)s | %(message)s")
-log = logging.getLogger("Perfect5Bot")
-
-# -----------------------------
-# Env Variables
-# -----------------------------
-BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
-CHAT_ID = os.getenv("CHAT_ID")
-CSV_PATH = os.getenv("CSV_PATH", "ALL_WATCHLIST_SYMBOLS.csv")
-PORT = int(os.getenv("PORT", 8000))
-PAUSE_BETWEEN_SYMBOLS = float(os.getenv("PAUSE_BETWEEN_SYMBOLS", "5"))
-SLEEP_BETWEEN_SCANS = float(os.getenv("SLEEP_BETWEEN_SCANS", "300"))
-N_BARS = int(os.getenv("N_BARS", "96"))
-
-FALLBACK_EXCHANGES = ["NSE","BSE","MCX","TVC","INDEX","OANDA","SKILLING","CAPITALCOM","VANTAGE","IG","SPREADEX","SZSE","NSEIX"]
-
-# Global: Prevent duplicate signals within 25 minutes
-last_signal_sent = {}
-
-# -----------------------------
-# Market Timings (IST, Mon-Fri unless specified) - Updated for All Exchanges
-# -----------------------------
-MARKET_TIMINGS = {
-    "NSE": {"start": "09:15", "end": "15:30", "days": [0,1,2,3,4]},  # Mon-Fri
-    "BSE": {"start": "09:00", "end": "15:30", "days": [0,1,2,3,4]},  # Mon-Fri
-    "MCX": {"start": "09:00", "end": "23:55", "days": [0,1,2,3,4]},  # Mon-Sat
-    "IG": {"start": "00:00", "end": "23:59", "days": [0,1,2,3,4]},  # 24/5 Forex/CFDs
-    "CAPITALCOM": {"start": "00:00", "end": "23:59", "days": [0,1,2,3,4]},  # 24/5 CFDs
-    "SPREADEX": {"start": "00:00", "end": "23:59", "days": [0,1,2,3,4]},  # Approx Mon-Fri (12:30PM-2:30AM IST)
-    "TVC": {"start": "00:00", "end": "23:59", "days": [0,1,2,3,4]},  # 24/7 Composites (Crypto/Indices vary)
-    "INDEX": {"start": "00:00", "end": "23:59", "days": [0,1,2,3,4,5,6]},  # Default NSE/BSE
-    "OANDA": {"start": "00:00", "end": "23:59", "days": [0,1,2,3,4]},  # 24/5 Forex
-    "NSEIX": {"start": "00:00", "end": "23:59", "days": [0,1,2,3,4]},  # NSE Indices (same as NSE)
-    "SKILLING": {"start": "00:00", "end": "23:59", "days": [0,1,2,3,4]},  # 24/5 CFD/Forex
-    "SZSE": {"start": "00:00", "end": "23:59", "days": [0,1,2,3,4]},  # Mon-Fri (CST to IST: 9:30-11:30 + 13:00-14:57 CST)
-    "VANTAGE": {"start": "00:00", "end": "23:59", "days": [0,1,2,3,4]},  # 24/5 Forex/CFD
-    "DEFAULT": {"start": "09:00", "end": "17:00", "days": [0,1,2,3,4]}  # Fallback
-}
-
-def is_market_open(exchange: str) -> bool:
-    """Check if current IST time is within market hours for the exchange."""
-    now_utc = datetime.now(timezone.utc)
-    ist_offset = timedelta(hours=5, minutes=30)
-    now_ist = now_utc + ist_offset
-    current_time = now_ist.time()
-    current_day = now_ist.weekday()  # 0=Mon, 6=Sun
-
-    timings = MARKET_TIMINGS.get(exchange.upper(), MARKET_TIMINGS["DEFAULT"])
-    if current_day not in timings["days"]:
-        log.debug("Market closed: Weekend/Holiday for %s (day %d)", exchange, current_day)
-        return False
-
-    start_time = datetime.strptime(timings["start"], "%H:%M").time()
-    end_time = datetime.strptime(timings["end"], "%H:%M").time()
-
-    # Handle overnight/24h sessions
-    if start_time < end_time:
-        return start_time <= current_time <= end_time
-    else:  # Overnight (end next day)
-        return current_time >= start_time or current_time <= end_time
-
-# -----------------------------
-# Telegram helper
-# -----------------------------
-def send_telegram_message(text: str):
-    if not BOT_TOKEN or not CHAT_ID:
-        log.warning("Telegram credentials missing — message not sent.")
-        return
-    try:
-        url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage"
-        resp = requests.post(url, data={"chat_id": CHAT_ID, "text": text, "parse_mode": "Markdown"})
-        if resp.status_code != 200:
-            log.error("Telegram error %s: %s", resp.status_code, resp.text)
-    except Exception as e:
-        log.exception("Telegram send failed: %s", e)
-
-# -----------------------------
-# Load symbols
-# -----------------------------
-if not os.path.exists(CSV_PATH):
-    log.error("CSV file not found: %s", CSV_PATH)
-    raise SystemExit(1)
-
-symbols_df = pd.read_csv(CSV_PATH)
-if "SYMBOL" not in symbols_df.columns:
-    log.error("CSV must have a 'SYMBOL' column.")
-    raise SystemExit(1)
-
-symbols = symbols_df["SYMBOL"].dropna().astype(str).tolist()
-log.info("Loaded %d symbols from CSV", len(symbols))
-
-# -----------------------------
-# tvDatafeed init with cookies.b64.txt (Render Ready)
-# -----------------------------
-COOKIES_B64_FILE = "cookies.b64.txt"
-
-def init_tv():
-    global tv
-
-    # 1. Try loading from cookies.b64.txt
-    if os.path.exists(COOKIES_B64_FILE):
-        try:
-            with open(COOKIES_B64_FILE, 'r') as f:
-                b64_data = f.read().strip()
-            cookies_data = base64.b64decode(b64_data)
-            cookies = pickle.loads(cookies_data)
-            tv = TvDatafeed(cookies=cookies)
-            log.info("tvDatafeed loaded from cookies.b64.txt (authenticated)")
-            return
-        except Exception as e:
-            log.warning("Failed to load cookies.b64.txt: %s", e)
-
-    # 2. Fallback: Try login with env vars
-    username = os.getenv("TV_USERNAME")
-    password = os.getenv("TV_PASSWORD")
-    if username and password:
-        try:
-            tv = TvDatafeed(username=username, password=password)
-            log.info("Logged in successfully")
-            
-            # Safe cookies save: Check if cookies attribute exists
-            if hasattr(tv, 'cookies') and tv.cookies:
-                try:
-                    cookies_data = pickle.dumps(tv.cookies)
-                    b64_data = base64.b64encode(cookies_data).decode('utf-8')
-                    with open(COOKIES_B64_FILE, 'w') as f:
-                        f.write(b64_data)
-                    log.info("Logged in & cookies saved to cookies.b64.txt")
-                except Exception as save_e:
-                    log.warning("Could not save cookies.b64.txt: %s", save_e)
-            else:
-                log.warning("Login succeeded but no cookies attribute found")
-            return
-        except Exception as e:
-            log.warning("Login failed: %s", e)
-
-    # 3. Final fallback: nologin
-    log.warning("No cookies/login → using nologin mode (may timeout)")
-    tv = TvDatafeed()
-
-# === CALL INIT (ONLY ONCE) ===
-init_tv()
-
-# === SYMBOL PARSER ===
-def parse_symbol(raw: str):
-    s = str(raw).strip()
-    if not s: return ("NSE", "")
-    if ":" in s:
-        ex, sym = s.split(":", 1)
-        return (ex.strip().upper(), sym.strip())
-    up = s.upper()
-    if up.endswith(".NS") or up.endswith("-NS"): return ("NSE", s[:-3])
-    if up.endswith(".BO") or up.endswith("-BO"): return ("BSE", s[:-3])
-    return ("NSE", s)
-
-# === TRY GET HIST WITH FALLBACK ===
-def try_get_hist(tvc, symbol, exchange, interval, n_bars):
-    tried = []
-    if exchange: tried.append(exchange)
-    tried.extend([e for e in FALLBACK_EXCHANGES if e not in tried])
-    tried.append(None)
-
-    last_exc = None
-    for ex in tried:
-        try:
-            try:
-                df = tvc.get_hist(symbol=symbol, exchange=ex, interval=interval, n_bars=n_bars)
-            except TypeError:
-                df = tvc.get_hist(symbol=symbol, exchange=ex, interval=interval, n=n_bars)
-            if df is not None and not df.empty:
-                return df, ex
-        except Exception as e:
-            last_exc = e
-            log.debug("get_hist failed for %s @ %s: %s", symbol, ex or "None", e)
-            continue
-    if last_exc: raise last_exc
-    return None, None
-
-# -----------------------------
-# Supertrend function
-# -----------------------------
-def compute_supertrend(df, period=10, multiplier=3.0):
-    df_local = df.copy().reset_index(drop=True)
-    hl2 = (df_local['high'] + df_local['low']) / 2.0
-    atr = AverageTrueRange(high=df_local['high'], low=df_local['low'], close=df_local['close'], window=period).average_true_range()
-    upper = hl2 + multiplier * atr
-    lower = hl2 - multiplier * atr
-
-    final_upper = upper.copy()
-    final_lower = lower.copy()
-    sup = pd.Series(index=df_local.index, dtype='float64')
-    dirn = pd.Series(index=df_local.index, dtype='int64')
-
-    for i in range(len(df_local)):
-        if i == 0:
-            final_upper.iat[i] = upper.iat[i]
-            final_lower.iat[i] = lower.iat[i]
-            sup.iat[i] = final_upper.iat[i]
-            dirn.iat[i] = 1
-            continue
-
-        fu_prev = final_upper.iat[i-1]
-        fl_prev = final_lower.iat[i-1]
-        close_prev = df_local['close'].iat[i-1]
-
-        fu = upper.iat[i] if (upper.iat[i] < fu_prev or close_prev > fu_prev) else fu_prev
-        fl = lower.iat[i] if (lower.iat[i] > fl_prev or close_prev < fl_prev) else fl_prev
-        final_upper.iat[i] = fu
-        final_lower.iat[i] = fl
-
-        if df_local['close'].iat[i] > fu_prev:
-            dirn.iat[i] = 1
-            sup.iat[i] = fl
-        elif df_local['close'].iat[i] < fl_prev:
-            dirn.iat[i] = -1
-            sup.iat[i] = fu
-        else:
-            dirn.iat[i] = dirn.iat[i-1]
-            sup.iat[i] = sup.iat[i-1]
-
-    return sup, dirn
-
-# -----------------------------
-# Strategy: Find LATEST crossover in last N_BARS (with Market Hours Check)
-# -----------------------------
-def calculate_signals(raw_symbol: str):
-    global tv
-    try:
-        ex_token, sym_token = parse_symbol(raw_symbol)
-        ex_token = ex_token or "NSE"
-        sym_token = str(sym_token).strip()
-        if not sym_token: return
-
-        # === MARKET HOURS CHECK ===
-        if not is_market_open(ex_token):
-            log.debug("Market closed for %s (%s) — skipping scan", raw_symbol, ex_token)
-            return
-
-        df, used_ex = try_get_hist(tv, sym_token, ex_token, Interval.in_30_minute, N_BARS)
-        if df is None or df.empty:
-            log.debug("No data for %s", raw_symbol)
-            return
-
-        # Normalize
-        if 'datetime' not in df.columns:
-            if isinstance(df.index, pd.DatetimeIndex):
-                df = df.copy()
-                df['datetime'] = df.index
-            else:
-                df = df.reset_index().rename(columns={df.columns[0]: "datetime"})
-        else:
-            df = df.loc[:, ~df.columns.duplicated()].copy()
-
-        if not pd.api.types.is_datetime64_any_dtype(df['datetime']):
-            df['datetime'] = pd.to_datetime(df['datetime'], errors='coerce')
-        for c in ["close", "high", "low"]:
-            df[c] = pd.to_numeric(df[c], errors="coerce")
-        df.dropna(subset=['datetime','close','high','low'], inplace=True)
-        if len(df) < 10:
-            log.debug("Insufficient bars for %s (len=%d)", raw_symbol, len(df))
-            return
-
-        # Indicators
-        ema20 = EMAIndicator(df["close"], window=20).ema_indicator()
-        super_series, _ = compute_supertrend(df, period=10, multiplier=3.0)
-        atr_series = AverageTrueRange(high=df["high"], low=df["low"], close=df["close"], window=14).average_true_range()
-
-        display = f"{used_ex or ex_token}:{sym_token}"
-        key = f"{used_ex or ex_token}:{sym_token}"
-
-        # Find LATEST crossover
-        start_idx = max(1, len(df) - N_BARS)
-        end_idx = len(df)
-
-        latest_buy = None
-        latest_sell = None
-        latest_time = None
-
-        for i in range(start_idx, end_idx):
-            try:
-                close_now = float(df["close"].iat[i])
-                close_prev = float(df["close"].iat[i-1])
-                ema20_now = float(ema20.iat[i]) if not pd.isna(ema20.iat[i]) else None
-                ema20_prev = float(ema20.iat[i-1]) if not pd.isna(ema20.iat[i-1]) else None
-                super_now = float(super_series.iat[i]) if not pd.isna(super_series.iat[i]) else None
-                super_prev = float(super_series.iat[i-1]) if not pd.isna(super_series.iat[i-1]) else None
-                atr_now = float(atr_series.iat[i]) if not pd.isna(atr_series.iat[i]) else 0.0
-                signal_time = df["datetime"].iat[i]
-
-                if ema20_now is None or ema20_prev is None or super_now is None or super_prev is None:
-                    continue
-
-                buy = (close_now > ema20_now) and (close_now > super_now) and \
-                      not ((close_prev > ema20_prev) and (close_prev > super_prev))
-
-                sell = (close_now < ema20_now) and (close_now < super_now) and \
-                       not ((close_prev < ema20_prev) and (close_prev < super_prev))
-
-                if buy or sell:
-                    current_time = signal_time if not pd.isna(signal_time) else datetime.utcnow()
-                    if latest_time is None or current_time > latest_time:
-                        latest_time = current_time
-                        if buy:
-                            latest_buy = (close_now, atr_now)
-                            latest_sell = None
-                        if sell:
-                            latest_sell = (close_now, atr_now)
-                            latest_buy = None
-
-            except Exception as e:
-                log.debug("Error in bar %d for %s: %s", i, display, e)
-                continue
-
-        # SEND ONLY LATEST SIGNAL
-        if latest_buy or latest_sell:
-            close_now, atr_now = (latest_buy or latest_sell)
-            is_buy = latest_buy is not None
-
-            if pd.isna(latest_time):
-                signal_time_ist = datetime.utcnow().strftime("%d-%b %H:%M")
-            else:
-                if latest_time.tzinfo is None:
-                    signal_time_utc = latest_time
-                else:
-                    signal_time_utc = latest_time.astimezone(timezone.utc).replace(tzinfo=None)
-                signal_time_ist = (signal_time_utc + timedelta(hours=5, minutes=30)).strftime("%d-%b %H:%M")
-
-            now = datetime.now()
-            if key in last_signal_sent and (now - last_signal_sent[key]).total_seconds() < 25 * 60:
-                log.debug("Duplicate signal skipped for %s", display)
-                return
-            last_signal_sent[key] = now
-
-            if is_buy:
-                tp = close_now + atr_now * 4.5
-                sl = close_now - atr_now * 1.5
-                msg = (
-                    f"**PERFECT 5 SIGNAL - BUY**\n"
-                    f"Symbol: `{display}`\n"
-                    f"Price: `{close_now:.2f}`\n"
-                    f"TP: `{tp:.2f}`\n"
-                    f"SL: `{sl:.2f}`\n"
-                    f"Time: `{signal_time_ist} IST`"
-                )
-                log.info("LATEST BUY → %s @ %s", display, signal_time_ist)
-                send_telegram_message(msg)
-            else:
-                tp = close_now - atr_now * 4.5
-                sl = close_now + atr_now * 1.5
-                msg = (
-                    f"**PERFECT 5 SIGNAL - SELL**\n"
-                    f"Symbol: `{display}`\n"
-                    f"Price: `{close_now:.2f}`\n"
-                    f"TP: `{tp:.2f}`\n"
-                    f"SL: `{sl:.2f}`\n"
-                    f"Time: `{signal_time_ist} IST`"
-                )
-                log.info("LATEST SELL → %s @ %s", display, signal_time_ist)
-                send_telegram_message(msg)
-
-    except Exception as e:
-        log.exception("Error processing %s: %s", raw_symbol, e)
-
-# -----------------------------
-# Main scan loop
-# -----------------------------
-def scan_loop():
-    log.info("Scanner started (%.1fs/symbol, %.1fs/round, last %d bars).",
-             PAUSE_BETWEEN_SYMBOLS, SLEEP_BETWEEN_SCANS, N_BARS)
-    while True:
-        start_time = datetime.now()
-        log.info("Starting scan at %s", start_time.strftime("%Y-%m-%d %H:%M:%S"))
-        for idx, sym in enumerate(symbols, 1):
-            try:
-                calculate_signals(sym)
-            except Exception:
-                log.exception("Exception scanning %s", sym)
-            log.info("Sleeping %.1fs... (%d/%d)", PAUSE_BETWEEN_SYMBOLS, idx, len(symbols))
-            time.sleep(PAUSE_BETWEEN_SYMBOLS)
-        log.info("Full scan complete. Sleeping %.1f seconds...", SLEEP_BETWEEN_SCANS)
-        time.sleep(SLEEP_BETWEEN_SCANS)
-
-# -----------------------------
-# Flask server
-# -----------------------------
-app = Flask(__name__)
-@app.route("/")
-def home():
-    return jsonify({"status": "Perfect5Bot", "time": datetime.now(timezone.utc).isoformat()})
-@app.route("/health")
-def health():
-    return "OK"
-@app.route("/ping")
-def ping():
-    return "pong"
-
-def start_flask():
-    log.info("Flask running on port %d", PORT)
-    app.run(host="0.0.0.0", port=PORT, debug=False, use_reloader=False)
-
-# -----------------------------
-# Launch
-# -----------------------------
-if __name__ == "__main__":
-    threading.Thread(target=scan_loop, daemon=True).start()
-    start_flask()
+# main.py — Perfect5Bot: Market Hours Filter Added (Full Exchanges)
+import asyncio, os, base64, copy, csv, json, logging, re, signal, sqlite3, sys, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from math import isnan
+from zoneinfo import ZoneInfo
+import numpy as np
+import pandas as pd
+import numba
+from numba import njit, prange
+import aiohttp
+from tvDatafeed import TvDatafeed, Interval
+import pickle
+
+# The batch kernel is launched from a scan worker thread; TBB's pool can hang
+# interpreter shutdown when started off the main thread, so prefer OpenMP/workqueue.
+numba.config.THREADING_LAYER_PRIORITY = ["omp", "workqueue", "tbb"]
+
+# -----------------------------
+# Logging
+# -----------------------------
+logging.basicConfig(level=logging.INFO, format="%(asctime)s | %(levelname)s | %(message)s")
+log = logging.getLogger("Perfect5Bot")
+
+# -----------------------------
+# Env Variables
+# -----------------------------
+BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
+CHAT_ID = os.getenv("CHAT_ID")
+CSV_PATH = os.getenv("CSV_PATH", "ALL_WATCHLIST_SYMBOLS.csv")
+PORT = int(os.getenv("PORT", 8000))
+SCAN_WORKERS = int(os.getenv("SCAN_WORKERS", "8"))
+TV_RATE = float(os.getenv("TV_RATE", "10"))    # TradingView requests/second (all workers)
+TV_BURST = int(os.getenv("TV_BURST", "20"))
+SLEEP_BETWEEN_SCANS = float(os.getenv("SLEEP_BETWEEN_SCANS", "300"))
+N_BARS = int(os.getenv("N_BARS", "96"))
+REFRESH_BARS = int(os.getenv("REFRESH_BARS", "3"))
+BARS_DB = os.getenv("BARS_DB", "bars.sqlite3")  # "" disables the on-disk bar store
+SIGNAL_STATE_PATH = os.getenv("SIGNAL_STATE_PATH", "last_signals.json")  # "" disables dedupe persistence
+
+# Strategy parameters
+EMA_PERIOD = 20
+ST_PERIOD, ST_MULT = 10, 3.0
+ATR_PERIOD = 14
+
+FALLBACK_EXCHANGES = ["NSE","BSE","MCX","TVC","INDEX","OANDA","SKILLING","CAPITALCOM","VANTAGE","IG","SPREADEX","SZSE","NSEIX"]
+
+# Global: Prevent duplicate signals within 25 minutes
+# Insertion order == send order, so expired entries are always at the front
+DEDUPE_WINDOW = timedelta(minutes=25)
+last_signal_sent = {}
+last_signal_lock = threading.Lock()
+
+def load_signal_state():
+    """Restore still-active dedupe entries saved by the previous run."""
+    if not SIGNAL_STATE_PATH or not os.path.exists(SIGNAL_STATE_PATH):
+        return
+    try:
+        with open(SIGNAL_STATE_PATH) as f:
+            saved = json.load(f)
+        cutoff = datetime.now() - DEDUPE_WINDOW
+        with last_signal_lock:
+            for key, sent in sorted(((k, datetime.fromisoformat(v)) for k, v in saved.items()), key=lambda kv: kv[1]):
+                if sent > cutoff:
+                    last_signal_sent[key] = sent
+        log.info("Restored %d recent signals for dedupe", len(last_signal_sent))
+    except (OSError, ValueError, AttributeError, TypeError) as e:
+        log.warning("Could not load %s: %s", SIGNAL_STATE_PATH, e)
+
+def save_signal_state():
+    if not SIGNAL_STATE_PATH:
+        return
+    with last_signal_lock:
+        state = {k: v.isoformat() for k, v in last_signal_sent.items()}
+    tmp = SIGNAL_STATE_PATH + ".tmp"
+    try:
+        with open(tmp, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp, SIGNAL_STATE_PATH)  # atomic: a crash never leaves half a file
+    except OSError as e:
+        log.warning("Could not save %s: %s", SIGNAL_STATE_PATH, e)
+
+# -----------------------------
+# Market Timings (IST, Mon-Fri unless specified) - Updated for All Exchanges
+# -----------------------------
+MARKET_TIMINGS = {
+    "NSE": {"start": "09:15", "end": "15:30", "days": [0,1,2,3,4]},  # Mon-Fri
+    "BSE": {"start": "09:00", "end": "15:30", "days": [0,1,2,3,4]},  # Mon-Fri
+    "MCX": {"start": "09:00", "end": "23:55", "days": [0,1,2,3,4]},  # Mon-Sat
+    "IG": {"start": "00:00", "end": "23:59", "days": [0,1,2,3,4]},  # 24/5 Forex/CFDs
+    "CAPITALCOM": {"start": "00:00", "end": "23:59", "days": [0,1,2,3,4]},  # 24/5 CFDs
+    "SPREADEX": {"start": "00:00", "end": "23:59", "days": [0,1,2,3,4]},  # Approx Mon-Fri (12:30PM-2:30AM IST)
+    "TVC": {"start": "00:00", "end": "23:59", "days": [0,1,2,3,4]},  # 24/7 Composites (Crypto/Indices vary)
+    "INDEX": {"start": "00:00", "end": "23:59", "days": [0,1,2,3,4,5,6]},  # Default NSE/BSE
+    "OANDA": {"start": "00:00", "end": "23:59", "days": [0,1,2,3,4]},  # 24/5 Forex
+    "NSEIX": {"start": "00:00", "end": "23:59", "days": [0,1,2,3,4]},  # NSE Indices (same as NSE)
+    "SKILLING": {"start": "00:00", "end": "23:59", "days": [0,1,2,3,4]},  # 24/5 CFD/Forex
+    "SZSE": {"start": "00:00", "end": "23:59", "days": [0,1,2,3,4]},  # Mon-Fri (CST to IST: 9:30-11:30 + 13:00-14:57 CST)
+    "VANTAGE": {"start": "00:00", "end": "23:59", "days": [0,1,2,3,4]},  # 24/5 Forex/CFD
+    "DEFAULT": {"start": "09:00", "end": "17:00", "days": [0,1,2,3,4]}  # Fallback
+}
+
+# Parsed once: exchange → (start time, end time, trading weekdays)
+_MARKET_HOURS = {
+    ex: (datetime.strptime(t["start"], "%H:%M").time(), datetime.strptime(t["end"], "%H:%M").time(), frozenset(t["days"]))
+    for ex, t in MARKET_TIMINGS.items()
+}
+
+IST = ZoneInfo("Asia/Kolkata")
+
+def ist_now():
+    return datetime.now(IST)
+
+def is_market_open(exchange: str, now_ist=None) -> bool:
+    """Check if IST time (default: now) is within market hours for the exchange."""
+    if now_ist is None:
+        now_ist = ist_now()
+    current_time = now_ist.time()
+    current_day = now_ist.weekday()  # 0=Mon, 6=Sun
+
+    start_time, end_time, days = _MARKET_HOURS.get(exchange.upper(), _MARKET_HOURS["DEFAULT"])
+    if current_day not in days:
+        log.debug("Market closed: Weekend/Holiday for %s (day %d)", exchange, current_day)
+        return False
+
+    # Handle overnight/24h sessions
+    if start_time < end_time:
+        return start_time <= current_time <= end_time
+    else:  # Overnight (end next day)
+        return current_time >= start_time or current_time <= end_time
+
+# -----------------------------
+# Telegram helper
+# -----------------------------
+# Messages are queued onto the event loop and posted by telegram_sender(), so
+# neither the scan workers nor the loop ever wait on Telegram.
+TG_QUEUE = asyncio.Queue(maxsize=512)  # bounded: a Telegram outage must not grow memory forever
+_LOOP = None  # set once the event loop is running
+
+TG_RETRIES = 2
+
+async def _post_telegram(session, text: str):
+    """POST one message; returns Telegram's final HTTP status (None if it never answered)."""
+    url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage"
+    payload = {"chat_id": CHAT_ID, "text": text, "parse_mode": "Markdown"}
+    for attempt in range(TG_RETRIES + 1):
+        delay = 0.3 * 2 ** attempt
+        try:
+            async with session.post(url, data=payload) as resp:
+                if resp.status == 200:
+                    return resp.status
+                body = await resp.text()
+                # Only a 429 is safe to retry: after a 5xx the alert may already
+                # be delivered, and a duplicate trading alert is worse than a lost one
+                if resp.status != 429 or attempt == TG_RETRIES:
+                    log.error("Telegram error %s: %s", resp.status, body)
+                    return resp.status
+                try:
+                    delay = max(delay, float(json.loads(body)["parameters"]["retry_after"]))
+                except (ValueError, KeyError, TypeError):
+                    pass
+        except aiohttp.ClientConnectorError as e:
+            # Connecting failed, so nothing was sent yet — safe to try again
+            if attempt == TG_RETRIES:
+                log.error("Telegram send failed: %s", e)
+                return
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            # Timeout or disconnect after the request went out: Telegram may
+            # have delivered it, so don't risk sending the alert twice
+            log.error("Telegram send failed: %r", e)
+            return
+        except Exception as e:
+            log.exception("Telegram send failed: %s", e)
+            return
+        await asyncio.sleep(delay)
+
+async def telegram_sender():
+    # One aiohttp session: keep-alive connection pool to api.telegram.org
+    connector = aiohttp.TCPConnector(limit=4, ttl_dns_cache=300)
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=5)) as session:
+        while True:
+            parts = await TG_QUEUE.get()
+            try:
+                status = await _post_telegram(session, "\n\n".join(parts))
+                if status == 400 and len(parts) > 1:
+                    # One malformed Markdown entity rejects the whole batch — resend
+                    # the signals one by one so only the broken one is lost
+                    log.warning("Batched message rejected — resending %d signals individually", len(parts))
+                    for part in parts:
+                        await _post_telegram(session, part)
+            finally:
+                TG_QUEUE.task_done()
+
+def _send_telegram_parts(parts):
+    """Thread-safe: queue `parts` for the sender, posted as one "\n\n"-joined message."""
+    if not BOT_TOKEN or not CHAT_ID:
+        log.warning("Telegram credentials missing — message not sent.")
+        return
+    if _LOOP is None:
+        log.warning("Event loop not running — message not sent.")
+        return
+    _LOOP.call_soon_threadsafe(_enqueue_telegram, parts)
+
+def _enqueue_telegram(parts):
+    try:
+        TG_QUEUE.put_nowait(parts)
+    except asyncio.QueueFull:
+        log.warning("Telegram queue full — dropping message")
+
+TG_MAX_LEN = 4096  # Telegram's sendMessage limit
+
+def send_telegram_batch(msgs):
+    """Pack a scan round's signals into as few messages as the length limit allows."""
+    chunk, size = [], 0
+    for msg in msgs:
+        if chunk and size + 2 + len(msg) > TG_MAX_LEN:
+            _send_telegram_parts(chunk)
+            chunk, size = [], 0
+        size += len(msg) + (2 if chunk else 0)
+        chunk.append(msg)
+    if chunk:
+        _send_telegram_parts(chunk)
+
+# -----------------------------
+# Load symbols
+# -----------------------------
+if not os.path.exists(CSV_PATH):
+    log.error("CSV file not found: %s", CSV_PATH)
+    raise SystemExit(1)
+
+# A list of strings doesn't need a DataFrame: one csv pass over SYMBOL/EXCHANGE
+with open(CSV_PATH, newline="", encoding="utf-8-sig") as f:
+    reader = csv.DictReader(f)
+    columns = {str(c).strip().upper(): c for c in reader.fieldnames or () if c is not None}
+    if "SYMBOL" not in columns:
+        log.error("CSV must have a 'SYMBOL' column.")
+        raise SystemExit(1)
+    sym_col, ex_col = columns["SYMBOL"], columns.get("EXCHANGE")
+    rows = [((row.get(sym_col) or "").strip(), (row.get(ex_col) or "").strip() if ex_col else "") for row in reader]
+
+symbols = [sym for sym, _ in rows if sym]
+log.info("Loaded %d symbols from CSV", len(symbols))
+
+# Optional EXCHANGE column: exchange for bare symbols, resolved once at startup
+# (keyed by upper-cased symbol so lookups are case-insensitive)
+SYMBOL_EXCHANGE = {sym.upper(): ex.upper() for sym, ex in rows if sym and ex}
+
+# -----------------------------
+# tvDatafeed init with cookies.b64.txt (Render Ready)
+# -----------------------------
+COOKIES_B64_FILE = "cookies.b64.txt"
+tv = None  # set by init_tv() when the scanner starts
+
+def init_tv():
+    global tv
+
+    # 1. Try loading from cookies.b64.txt
+    if os.path.exists(COOKIES_B64_FILE):
+        try:
+            with open(COOKIES_B64_FILE, 'rb') as f:
+                cookies_data = base64.b64decode(f.read().strip())
+            cookies = pickle.loads(cookies_data)
+            tv = TvDatafeed(cookies=cookies)
+            log.info("tvDatafeed loaded from cookies.b64.txt (authenticated)")
+            return
+        except Exception as e:
+            log.warning("Failed to load cookies.b64.txt: %s", e)
+
+    # 2. Fallback: Try login with env vars
+    username = os.getenv("TV_USERNAME")
+    password = os.getenv("TV_PASSWORD")
+    if username and password:
+        try:
+            tv = TvDatafeed(username=username, password=password)
+            log.info("Logged in successfully")
+            
+            # Safe cookies save: Check if cookies attribute exists
+            if hasattr(tv, 'cookies') and tv.cookies:
+                try:
+                    cookies_data = pickle.dumps(tv.cookies)
+                    b64_data = base64.b64encode(cookies_data).decode('utf-8')
+                    with open(COOKIES_B64_FILE, 'w') as f:
+                        f.write(b64_data)
+                    log.info("Logged in & cookies saved to cookies.b64.txt")
+                except Exception as save_e:
+                    log.warning("Could not save cookies.b64.txt: %s", save_e)
+            else:
+                log.warning("Login succeeded but no cookies attribute found")
+            return
+        except Exception as e:
+            log.warning("Login failed: %s", e)
+
+    # 3. Final fallback: nologin
+    log.warning("No cookies/login → using nologin mode (may timeout)")
+    tv = TvDatafeed()
+
+# === PER-THREAD TV HANDLE ===
+# TvDatafeed keeps a single websocket per instance, so each scan worker gets
+# its own shallow copy sharing the authenticated token/cookies.
+_tv_local = threading.local()
+_tv_lock = threading.Lock()
+
+def get_tv():
+    if not hasattr(_tv_local, "tv") or _tv_local.src is not tv:
+        with _tv_lock:
+            _tv_local.src = tv
+            _tv_local.tv = copy.copy(tv)
+    return _tv_local.tv
+
+# === SYMBOL PARSER ===
+_SUFFIX_RE = re.compile(r"[.\-](NS|BO)$", re.IGNORECASE)
+_SUFFIX_EXCHANGE = {"NS": "NSE", "BO": "BSE"}
+
+@lru_cache(maxsize=4096)
+def parse_symbol(raw: str):
+    s = str(raw).strip()
+    if not s: return ("NSE", "")
+    if ":" in s:
+        ex, sym = s.split(":", 1)
+        return (ex.strip().upper(), sym.strip())
+    # The suffix is always stripped; a CSV EXCHANGE value only overrides the exchange
+    ex = SYMBOL_EXCHANGE.get(s.upper())
+    m = _SUFFIX_RE.search(s)
+    if m: return (ex or _SUFFIX_EXCHANGE[m.group(1).upper()], s[:-3])
+    return (ex or "NSE", s)
+
+def parse_symbols(raw_symbols):
+    """(raw, exchange, symbol) for every distinct watchlist entry — parsed once, not per scan."""
+    parsed, seen = [], set()
+    for raw in raw_symbols:
+        ex_token, sym_token = parse_symbol(raw)
+        ex_token, sym_token = ex_token or "NSE", str(sym_token).strip()
+        if not sym_token or (ex_token, sym_token) in seen:
+            continue  # "RELIANCE", "RELIANCE.NS" and "NSE:RELIANCE" are one instrument
+        seen.add((ex_token, sym_token))
+        parsed.append((raw, ex_token, sym_token))
+    return parsed
+
+PARSED_SYMBOLS = parse_symbols(symbols)
+if len(PARSED_SYMBOLS) < len(symbols):
+    log.info("Scanning %d distinct symbols (%d duplicate/blank entries skipped)",
+             len(PARSED_SYMBOLS), len(symbols) - len(PARSED_SYMBOLS))
+
+# === TRADINGVIEW RATE LIMIT ===
+# Set on SIGTERM: scan workers stop walking fallback exchanges and waiting on the bucket
+STOP = threading.Event()
+
+class TokenBucket:
+    """Thread-safe token bucket: refills `rate` tokens/s, bursts up to `capacity`."""
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.stamp = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self):
+        """Block until a token is available; False if shutdown began while waiting."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+                self.stamp = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                wait = (1 - self.tokens) / self.rate
+            if STOP.wait(wait):
+                return False
+
+TV_BUCKET = TokenBucket(TV_RATE, TV_BURST)
+
+# === TRY GET HIST WITH FALLBACK ===
+def _get_hist(tvc, symbol, exchange, interval, n_bars):
+    if not TV_BUCKET.take():
+        return None
+    try:
+        return tvc.get_hist(symbol=symbol, exchange=exchange, interval=interval, n_bars=n_bars)
+    except TypeError:
+        return tvc.get_hist(symbol=symbol, exchange=exchange, interval=interval, n=n_bars)
+    finally:
+        # get_hist opens a fresh websocket per call and never closes the last one
+        ws = getattr(tvc, "ws", None)
+        if ws is not None:
+            try:
+                ws.close()
+            except Exception:
+                pass
+            tvc.ws = None
+
+# "EX:SYM" (as requested) → exchange that last returned data (None = bare symbol);
+# tried first so known fallbacks skip the exchanges that already failed
+WINNING_EX = {}
+
+def try_get_hist(tvc, symbol, exchange, interval, n_bars):
+    key = f"{exchange}:{symbol}"
+    tried = []
+    if exchange: tried.append(exchange)
+    tried.extend([e for e in FALLBACK_EXCHANGES if e not in tried])
+    tried.append(None)
+    if key in WINNING_EX:
+        winner = WINNING_EX[key]
+        if winner in tried:
+            tried.remove(winner)
+        tried.insert(0, winner)
+
+    last_exc = None
+    for ex in tried:
+        if STOP.is_set():
+            return None, None
+        try:
+            df = _get_hist(tvc, symbol, ex, interval, n_bars)
+            if df is not None and not df.empty:
+                WINNING_EX[key] = ex
+                return df, ex
+        except Exception as e:
+            last_exc = e
+            log.debug("get_hist failed for %s @ %s: %s", symbol, ex or "None", e)
+            continue
+    if last_exc: raise last_exc
+    return None, None
+
+# === BARS (SoA) ===
+@dataclass
+class Bars:
+    """OHLC window as contiguous float64 arrays plus their timestamps."""
+    ts: pd.DatetimeIndex
+    close: np.ndarray
+    high: np.ndarray
+    low: np.ndarray
+
+    def __len__(self):
+        return len(self.close)
+
+    @classmethod
+    def from_df(cls, df):
+        # get_hist already returns floats on a DatetimeIndex, so no copies are needed
+        if df.columns.has_duplicates:
+            df = df.loc[:, ~df.columns.duplicated()]
+        if 'datetime' in df.columns:
+            ts = pd.DatetimeIndex(pd.to_datetime(df['datetime'], errors='coerce'))
+        elif isinstance(df.index, pd.DatetimeIndex):
+            ts = df.index
+        else:
+            ts = pd.DatetimeIndex(pd.to_datetime(df.index, errors='coerce'))
+
+        close, high, low = [
+            (df[c] if df[c].dtype == np.float64 else pd.to_numeric(df[c], errors="coerce")).to_numpy(dtype=np.float64)
+            for c in ("close", "high", "low")
+        ]
+        valid = ~(np.isnan(close) | np.isnan(high) | np.isnan(low) | ts.isna())
+        if not valid.all():
+            return cls(ts[valid], close[valid], high[valid], low[valid])
+        return cls(ts, close, high, low)
+
+    def splice(self, new, n_bars):
+        """Replace everything from new.ts[0] onwards with `new`, keep the last n_bars."""
+        keep = self.ts < new.ts[0]
+        return Bars(
+            self.ts[keep].append(new.ts)[-n_bars:],
+            np.concatenate((self.close[keep], new.close))[-n_bars:],
+            np.concatenate((self.high[keep], new.high))[-n_bars:],
+            np.concatenate((self.low[keep], new.low))[-n_bars:],
+        )
+
+# === PERSISTENT BAR STORE (SQLite) ===
+# Keeps the rolling windows across restarts so a redeploy only needs the
+# REFRESH_BARS gap-fill per symbol instead of a full N_BARS download.
+_bars_db_conn = None
+_bars_db_lock = threading.Lock()
+
+def _bars_db():
+    global _bars_db_conn
+    if _bars_db_conn is None:
+        db = sqlite3.connect(BARS_DB, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute("CREATE TABLE IF NOT EXISTS bars (key TEXT, ts INTEGER, high REAL, low REAL, close REAL, "
+                   "PRIMARY KEY (key, ts)) WITHOUT ROWID")
+        db.execute("CREATE TABLE IF NOT EXISTS bar_meta (key TEXT PRIMARY KEY, exchange TEXT, tz TEXT)")
+        _bars_db_conn = db
+    return _bars_db_conn
+
+def load_bars(key, n_bars):
+    if not BARS_DB:
+        return None
+    try:
+        with _bars_db_lock:
+            db = _bars_db()
+            meta = db.execute("SELECT exchange, tz FROM bar_meta WHERE key = ?", (key,)).fetchone()
+            if meta is None:
+                return None
+            rows = db.execute("SELECT ts, high, low, close FROM bars WHERE key = ? ORDER BY ts DESC LIMIT ?",
+                              (key, n_bars)).fetchall()
+    except sqlite3.Error as e:
+        log.warning("Bar store read failed for %s: %s", key, e)
+        return None
+    if not rows:
+        return None
+    ts, high, low, close = zip(*reversed(rows))
+    idx = pd.DatetimeIndex(np.array(ts, dtype="datetime64[ns]"))
+    if meta[1]:
+        idx = idx.tz_localize("UTC").tz_convert(meta[1])
+    return Bars(idx, np.array(close), np.array(high), np.array(low)), meta[0]
+
+def save_bars(key, used_ex, bars, since=None):
+    """Store bars from `since` on (or the whole window), replacing what was stored there; older rows are pruned."""
+    if not BARS_DB:
+        return
+    ts = bars.ts
+    sel = slice(None) if since is None else np.asarray(ts >= since)
+    rows = list(zip(ts.as_unit("ns").asi8[sel].tolist(), bars.high[sel].tolist(),
+                    bars.low[sel].tolist(), bars.close[sel].tolist()))
+    tz = str(ts.tz) if ts.tz is not None else None
+    try:
+        with _bars_db_lock:
+            db = _bars_db()
+            with db:
+                if since is None:
+                    db.execute("DELETE FROM bars WHERE key = ?", (key,))
+                else:  # drop rows that slid out of the window or that the new tail replaces
+                    db.execute("DELETE FROM bars WHERE key = ? AND (ts < ? OR ts >= ?)",
+                               (key, int(ts[:1].as_unit("ns").asi8[0]), pd.Timestamp(since).as_unit("ns").value))
+                db.execute("INSERT OR REPLACE INTO bar_meta VALUES (?, ?, ?)", (key, used_ex, tz))
+                db.executemany("INSERT OR REPLACE INTO bars VALUES (?, ?, ?, ?, ?)",
+                               [(key, *r) for r in rows])
+    except sqlite3.Error as e:
+        log.warning("Bar store write failed for %s: %s", key, e)
+
+# === ROLLING BAR CACHE ===
+# Full N_BARS history is fetched once per symbol; later scans only pull the
+# newest REFRESH_BARS bars (re-reading the still-forming one) and splice them in.
+BAR_CACHE = {}  # "EX:SYM" (as requested) → (Bars of the last n_bars, exchange that served it)
+
+def get_bars(tvc, symbol, exchange, interval, n_bars):
+    key = f"{exchange}:{symbol}"
+    cached = BAR_CACHE.get(key)
+    if cached is None:
+        cached = load_bars(key, n_bars)  # window saved by a previous run
+        if cached is not None:
+            WINNING_EX.setdefault(key, cached[1])
+    if cached is not None:
+        old, used_ex = cached
+        try:
+            df = _get_hist(tvc, symbol, used_ex, interval, min(REFRESH_BARS, n_bars))
+            new = Bars.from_df(df) if df is not None and not df.empty else None
+        except Exception as e:
+            log.debug("Bar refresh failed for %s @ %s: %s", symbol, used_ex or "None", e)
+            new = None
+        # Only splice when the refresh overlaps the cached tail; a gap means refetch
+        if new is not None and len(new) and new.ts[0] <= old.ts[-1]:
+            bars = old.splice(new, n_bars)
+            BAR_CACHE[key] = (bars, used_ex)
+            save_bars(key, used_ex, bars, since=new.ts[0])
+            return bars, used_ex
+
+    df, used_ex = try_get_hist(tvc, symbol, exchange, interval, n_bars)
+    if df is None or df.empty:
+        BAR_CACHE.pop(key, None)
+        return None, used_ex
+    bars = Bars.from_df(df)
+    if len(bars):
+        BAR_CACHE[key] = (bars, used_ex)
+        save_bars(key, used_ex, bars)
+    else:
+        BAR_CACHE.pop(key, None)
+    return bars, used_ex
+
+# -----------------------------
+# EMA — same output as ta.trend.EMAIndicator (NaN until `period` bars)
+# -----------------------------
+@njit(cache=True, fastmath=True)
+def _ema(close, period):
+    n = len(close)
+    ema = np.empty(n, dtype=np.float64)
+    if n == 0:
+        return ema
+
+    alpha = 2.0 / (period + 1)
+    v = close[0]
+    ema[0] = v
+    for i in range(1, n):
+        v = alpha * close[i] + (1.0 - alpha) * v
+        ema[i] = v
+    ema[:min(period - 1, n)] = np.nan
+    return ema
+
+# -----------------------------
+# ATR (Wilder) — same seeding as ta.volatility.AverageTrueRange
+# -----------------------------
+@njit(cache=True, fastmath=True)
+def _true_range(high, low, close):
+    n = len(close)
+    tr = np.empty(n, dtype=np.float64)
+    if n == 0:
+        return tr
+
+    tr[0] = high[0] - low[0]
+    for i in range(1, n):
+        c_prev = close[i-1]
+        tr[i] = max(high[i] - low[i], abs(high[i] - c_prev), abs(low[i] - c_prev))
+    return tr
+
+@njit(cache=True, fastmath=True)
+def _wilder(tr, period):
+    n = len(tr)
+    atr = np.zeros(n, dtype=np.float64)
+    if n < period:
+        return atr
+
+    atr[period-1] = tr[:period].mean()
+    for i in range(period, n):
+        atr[i] = (atr[i-1] * (period - 1) + tr[i]) / period
+    return atr
+
+@njit(cache=True, fastmath=True)
+def _wilder_atr(high, low, close, period):
+    return _wilder(_true_range(high, low, close), period)
+
+# -----------------------------
+# Supertrend function
+# -----------------------------
+@njit(cache=True, fastmath=True)
+def _supertrend_core(upper, lower, close):
+    n = len(close)
+    sup = np.empty(n, dtype=np.float64)
+    dirn = np.empty(n, dtype=np.int8)
+    if n == 0:
+        return sup, dirn
+
+    fu_prev = upper[0]
+    fl_prev = lower[0]
+    sup[0] = fu_prev
+    dirn[0] = 1
+
+    for i in range(1, n):
+        close_prev = close[i-1]
+        fu = upper[i] if (upper[i] < fu_prev or close_prev > fu_prev) else fu_prev
+        fl = lower[i] if (lower[i] > fl_prev or close_prev < fl_prev) else fl_prev
+
+        if close[i] > fu_prev:
+            dirn[i] = 1
+            sup[i] = fl
+        elif close[i] < fl_prev:
+            dirn[i] = -1
+            sup[i] = fu
+        else:
+            dirn[i] = dirn[i-1]
+            sup[i] = sup[i-1]
+
+        fu_prev = fu
+        fl_prev = fl
+
+    return sup, dirn
+
+@njit(cache=True, fastmath=True)
+def _supertrend_from_atr(high, low, close, atr, multiplier):
+    hl2 = (high + low) * 0.5
+    upper = hl2 + multiplier * atr
+    lower = hl2 - multiplier * atr
+
+    return _supertrend_core(upper, lower, close)
+
+@njit(cache=True, fastmath=True)
+def compute_supertrend(high, low, close, period=10, multiplier=3.0):
+    return _supertrend_from_atr(high, low, close, _wilder_atr(high, low, close, period), multiplier)
+
+# -----------------------------
+# Batched indicators: one row per symbol, computed in parallel
+# -----------------------------
+# No fastmath here: it lets LLVM assume NaN never occurs and drop the isnan checks
+@njit(cache=True)
+def _latest_cross(close, ema, sup, ts, start):
+    """Index of the newest bar (by timestamp) where close crosses above/below both
+    EMA and Supertrend, and whether it is a buy; (-1, False) if there is none."""
+    best = -1
+    best_buy = False
+    for i in range(max(start, 1), len(close)):
+        e_now, e_prev, s_now, s_prev = ema[i], ema[i-1], sup[i], sup[i-1]
+        if np.isnan(e_now) or np.isnan(e_prev) or np.isnan(s_now) or np.isnan(s_prev):
+            continue
+        c_now, c_prev = close[i], close[i-1]
+        if c_now > e_now and c_now > s_now:
+            if c_prev > e_prev and c_prev > s_prev:
+                continue
+            buy = True
+        elif c_now < e_now and c_now < s_now:
+            if c_prev < e_prev and c_prev < s_prev:
+                continue
+            buy = False
+        else:
+            continue
+        if best < 0 or ts[i] > ts[best]:
+            best = i
+            best_buy = buy
+    return best, best_buy
+
+@njit(parallel=True, nogil=True, cache=True, fastmath=True)
+def _indicators_batch(close, high, low, ts, lengths, ema_period, st_period, st_mult, atr_period, window):
+    """Per symbol row: latest crossover index (-1 if none), buy flag and ATR at that bar."""
+    n_sym = close.shape[0]
+    cross = np.full(n_sym, -1, dtype=np.int64)
+    is_buy = np.zeros(n_sym, dtype=np.bool_)
+    cross_atr = np.full(n_sym, np.nan)
+    for s in prange(n_sym):
+        n = lengths[s]
+        c = close[s, :n]
+        h = high[s, :n]
+        l = low[s, :n]
+        tr = _true_range(h, l, c)  # shared by the Supertrend ATR and the stop ATR
+        ema = _ema(c, ema_period)
+        sup = _supertrend_from_atr(h, l, c, _wilder(tr, st_period), st_mult)[0]
+        # only the last `window` bars are scanned, and never before the EMA is seeded
+        i, buy = _latest_cross(c, ema, sup, ts[s, :n], max(ema_period, n - window))
+        if i >= 0:
+            cross[s] = i
+            is_buy[s] = buy
+            cross_atr[s] = _wilder(tr, atr_period)[i]
+    return cross, is_buy, cross_atr
+
+def compute_indicators(batch):
+    """Stack every fetched symbol's bars (NaN-padded) and find each one's latest crossover in one kernel call."""
+    lengths = np.array([len(bars) for _, _, bars in batch], dtype=np.int64)
+    shape = (len(batch), int(lengths.max()))
+    close, high, low = np.full(shape, np.nan), np.full(shape, np.nan), np.full(shape, np.nan)
+    ts = np.zeros(shape, dtype=np.int64)
+    for row, (_, _, bars) in enumerate(batch):
+        n = len(bars)
+        close[row, :n] = bars.close
+        high[row, :n] = bars.high
+        low[row, :n] = bars.low
+        ts[row, :n] = bars.ts.asi8
+    return _indicators_batch(close, high, low, ts, lengths, EMA_PERIOD, ST_PERIOD, ST_MULT, ATR_PERIOD, N_BARS)
+
+def warm_up_kernels():
+    """Compile (or load from the numba cache) every kernel on a 60-bar dummy series."""
+    start = time.monotonic()
+    x = 100.0 + np.sin(np.arange(60, dtype=np.float64))
+    dummy = Bars(pd.date_range("2000-01-03", periods=60, freq="30min"), x, x + 1.0, x - 1.0)
+    compute_indicators([("WARMUP", "WARMUP", dummy)])
+    log.info("Indicator kernels ready in %.2fs", time.monotonic() - start)
+
+# -----------------------------
+# Fetch: market-hours check + bars for one symbol (runs on scan workers)
+# -----------------------------
+def fetch_symbol(raw_symbol: str, ex_token: str, sym_token: str, now_ist=None):
+    try:
+        # === MARKET HOURS CHECK ===
+        if not is_market_open(ex_token, now_ist):
+            log.debug("Market closed for %s (%s) — skipping scan", raw_symbol, ex_token)
+            return None
+
+        bars, used_ex = get_bars(get_tv(), sym_token, ex_token, Interval.in_30_minute, N_BARS)
+        if bars is None:
+            log.debug("No data for %s", raw_symbol)
+            return None
+        if len(bars) < 10:
+            log.debug("Insufficient bars for %s (len=%d)", raw_symbol, len(bars))
+            return None
+
+        return raw_symbol, f"{used_ex or ex_token}:{sym_token}", bars
+    except Exception as e:
+        log.exception("Error processing %s: %s", raw_symbol, e)
+        return None
+
+# -----------------------------
+# Strategy: report the LATEST crossover found in the last N_BARS
+# -----------------------------
+def calculate_signals(raw_symbol, key, bars, i, is_buy, atr_now, now=None):
+    """Format the latest crossover (bar i) for Telegram unless it was just sent."""
+    try:
+        display = key
+        close_now = float(bars.close[i])
+        atr_now = float(atr_now)
+        if isnan(atr_now):
+            atr_now = 0.0
+
+        latest_time = bars.ts[i]
+        if latest_time.tzinfo is None:  # naive feed timestamps are taken as UTC
+            latest_time = latest_time.tz_localize("UTC")
+        signal_time_ist = latest_time.tz_convert(IST).strftime("%d-%b %H:%M")
+
+        now = now or datetime.now()
+        with last_signal_lock:
+            if key in last_signal_sent and now - last_signal_sent[key] < DEDUPE_WINDOW:
+                log.debug("Duplicate signal skipped for %s", display)
+                return None
+            last_signal_sent.pop(key, None)
+            last_signal_sent[key] = now
+            while now - next(iter(last_signal_sent.values())) >= DEDUPE_WINDOW:
+                del last_signal_sent[next(iter(last_signal_sent))]
+
+        if is_buy:
+            tp = close_now + atr_now * 4.5
+            sl = close_now - atr_now * 1.5
+            msg = (
+                f"**PERFECT 5 SIGNAL - BUY**\n"
+                f"Symbol: `{display}`\n"
+                f"Price: `{close_now:.2f}`\n"
+                f"TP: `{tp:.2f}`\n"
+                f"SL: `{sl:.2f}`\n"
+                f"Time: `{signal_time_ist} IST`"
+            )
+            log.info("LATEST BUY → %s @ %s", display, signal_time_ist)
+        else:
+            tp = close_now - atr_now * 4.5
+            sl = close_now + atr_now * 1.5
+            msg = (
+                f"**PERFECT 5 SIGNAL - SELL**\n"
+                f"Symbol: `{display}`\n"
+                f"Price: `{close_now:.2f}`\n"
+                f"TP: `{tp:.2f}`\n"
+                f"SL: `{sl:.2f}`\n"
+                f"Time: `{signal_time_ist} IST`"
+            )
+            log.info("LATEST SELL → %s @ %s", display, signal_time_ist)
+        return msg
+
+    except Exception as e:
+        log.exception("Error processing %s: %s", raw_symbol, e)
+
+# -----------------------------
+# Main scan loop
+# -----------------------------
+async def scan_round(pool, parsed_symbols):
+    loop = asyncio.get_running_loop()
+    now_ist = ist_now()  # one clock read per round for every market-hours check
+
+    # 1) fetch concurrently on the worker pool (tvDatafeed is blocking)
+    results = await asyncio.gather(
+        *(loop.run_in_executor(pool, fetch_symbol, *item, now_ist) for item in parsed_symbols),
+        return_exceptions=True,
+    )
+    batch = []
+    for (sym, _, _), item in zip(parsed_symbols, results):
+        if isinstance(item, BaseException):
+            log.error("Exception scanning %s", sym, exc_info=item)
+        elif item:
+            batch.append(item)
+    if not batch:
+        return
+
+    # 2) indicators + latest crossover for every symbol in one kernel call (releases the GIL)
+    cross, is_buy, cross_atr = await loop.run_in_executor(pool, compute_indicators, batch)
+
+    # 3) format each symbol's latest crossover, then one Telegram flush for the round
+    msgs = []
+    now = datetime.now()
+    for row in np.flatnonzero(cross >= 0):
+        raw, key, bars = batch[row]
+        msg = calculate_signals(raw, key, bars, int(cross[row]), bool(is_buy[row]), cross_atr[row], now)
+        if msg:
+            msgs.append(msg)
+    send_telegram_batch(msgs)
+    if msgs:
+        save_signal_state()
+
+async def scan_loop():
+    log.info("Scanner started (%d workers, %.1fs/round, last %d bars).",
+             SCAN_WORKERS, SLEEP_BETWEEN_SCANS, N_BARS)
+    loop = asyncio.get_running_loop()
+    # No `with`: its exit joins the workers on the event loop thread, which would
+    # freeze the loop (and the Telegram drain) for a cancelled round's in-flight fetches
+    pool = ThreadPoolExecutor(max_workers=SCAN_WORKERS, thread_name_prefix="scan")
+    try:
+        # Log in and compile kernels off the loop, so the health server answers
+        # during a slow TradingView login instead of after it
+        await asyncio.gather(loop.run_in_executor(pool, init_tv), loop.run_in_executor(pool, warm_up_kernels))
+        while True:
+            start_time = datetime.now()
+            log.info("Starting scan at %s", start_time.strftime("%Y-%m-%d %H:%M:%S"))
+            try:
+                await scan_round(pool, PARSED_SYMBOLS)
+            except Exception:
+                log.exception("Scan round failed")
+            log.info("Full scan complete in %.1fs. Sleeping %.1f seconds...",
+                     (datetime.now() - start_time).total_seconds(), SLEEP_BETWEEN_SCANS)
+            await asyncio.sleep(SLEEP_BETWEEN_SCANS)
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+# -----------------------------
+# Health server (plain asyncio — three static routes don't need a framework)
+# -----------------------------
+_HTTP_STATUS = {200: "OK", 404: "Not Found", 405: "Method Not Allowed"}
+
+def _route(path):
+    if path == "/":
+        body = json.dumps({"status": "Perfect5Bot", "time": datetime.now(timezone.utc).isoformat()})
+        return 200, "application/json", body
+    if path == "/health":
+        return 200, "text/html; charset=utf-8", "OK"
+    if path == "/ping":
+        return 200, "text/html; charset=utf-8", "pong"
+    return 404, "text/plain; charset=utf-8", "Not Found"
+
+HTTP_MAX_HEADERS = 100
+
+async def _read_request_head(reader):
+    request_line = await reader.readline()
+    for _ in range(HTTP_MAX_HEADERS):  # skip headers
+        if await reader.readline() in (b"\r\n", b"\n", b""):
+            return request_line
+    raise ValueError("too many header lines")
+
+async def _handle_http(reader, writer):
+    try:
+        # One deadline for the whole request head, so a slow client can't hold the socket
+        request_line = await asyncio.wait_for(_read_request_head(reader), timeout=10)
+        parts = request_line.decode("latin-1").split()
+        method = parts[0] if parts else ""
+        path = parts[1].split("?", 1)[0] if len(parts) > 1 else "/"
+        if method in ("GET", "HEAD"):
+            status, ctype, body = _route(path)
+        else:
+            status, ctype, body = 405, "text/plain; charset=utf-8", "Method Not Allowed"
+
+        payload = body.encode("utf-8")
+        head = (f"HTTP/1.1 {status} {_HTTP_STATUS[status]}\r\n"
+                f"Content-Type: {ctype}\r\n"
+                f"Content-Length: {len(payload)}\r\n"
+                f"Connection: close\r\n\r\n").encode("latin-1")
+        writer.write(head if method == "HEAD" else head + payload)
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError, ValueError, asyncio.LimitOverrunError):
+        pass  # timed out, reset, or an oversized/garbled request head
+    finally:
+        writer.close()
+
+async def serve_health():
+    server = await asyncio.start_server(_handle_http, "0.0.0.0", PORT)
+    log.info("Health server running on port %d", PORT)
+    async with server:
+        await server.serve_forever()
+
+# -----------------------------
+# Launch: health server, scanner and Telegram sender share one event loop
+# -----------------------------
+async def supervise(name, coro_fn, backoff=5.0, max_backoff=300.0):
+    """Restart a crashed task with exponential backoff; a long healthy run resets the delay."""
+    delay = backoff
+    while True:
+        started = time.monotonic()
+        try:
+            await coro_fn()
+            log.warning("%s exited — restarting", name)
+        except Exception:
+            log.exception("%s crashed — restarting in %.0fs", name, delay)
+        if time.monotonic() - started >= max_backoff:
+            delay = backoff
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, max_backoff)
+
+async def main():
+    global _LOOP
+    _LOOP = asyncio.get_running_loop()
+    load_signal_state()
+
+    # SIGTERM (Render redeploy) stops the scanner mid-sleep instead of waiting
+    # out the round; queued alerts get a short grace period to go out
+    stop = asyncio.Event()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            _LOOP.add_signal_handler(sig, stop.set)
+        except NotImplementedError:  # Windows
+            pass
+
+    tasks = [asyncio.create_task(serve_health()), asyncio.create_task(supervise("Scanner", scan_loop))]
+    sender = asyncio.create_task(supervise("Telegram sender", telegram_sender))
+    stopper = asyncio.create_task(stop.wait())
+    done, _ = await asyncio.wait([stopper, sender, *tasks], return_when=asyncio.FIRST_COMPLETED)
+    log.info("Shutting down")
+    STOP.set()
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    try:
+        await asyncio.wait_for(TG_QUEUE.join(), timeout=5)
+    except asyncio.TimeoutError:
+        log.warning("Shutdown: Telegram queue not drained in time — remaining alerts dropped")
+    sender.cancel()
+    stopper.cancel()
+    save_signal_state()
+    for task in done - {stopper}:
+        task.result()  # e.g. the health port was already taken
+
+if __name__ == "__main__":
+    # `python main.py --compile-only` at build time fills Numba's on-disk cache
+    # (cache=True), so a fresh deploy loads the kernels instead of compiling them
+    if "--compile-only" in sys.argv:
+        warm_up_kernels()
+        raise SystemExit(0)
+    asyncio.run(main())